@@ -5,6 +5,7 @@ Author: Nikolay Lysenko
 """
 
 
+import math
 from typing import Any, Callable
 
 from dodecaphony.fragment import Fragment
@@ -104,6 +105,8 @@ def parse_scoring_sets_registry(params: list[dict[str, Any]]) -> SCORING_SETS_RE
         for scoring_fn_info in scoring_set_params['scoring_functions']:
             scoring_fn = scoring_functions_registry[scoring_fn_info.pop('name')]
             weights = scoring_fn_info.pop('weights')
+            if any(slope < 0 for slope in weights.values()):
+                raise ValueError(f"Weights must be non-negative, but {weights} are passed.")
             scoring_fns.append((scoring_fn, weights, scoring_fn_info))
         scoring_sets_registry[scoring_set_name] = scoring_fns
     return scoring_sets_registry
@@ -134,7 +137,8 @@ def evaluate(
         fragment: Fragment,
         scoring_sets: list[str],
         scoring_sets_registry: SCORING_SETS_REGISTRY_TYPE,
-        report: bool = False
+        report: bool = False,
+        cutoff: float = -math.inf
 ) -> tuple[float, str]:
     """
     Evaluate fragment and report results.
@@ -148,21 +152,29 @@ def evaluate(
         its weight, and its parameters
     :param report:
         if it is set to `True`, scores detailed to function level are returned as a second output
+    :param cutoff:
+        if score becomes lower than this value, evaluation is stopped and partial score is returned;
+        weighted scores are non-positive, so the final score can not be higher than the partial one
     :return:
         weighted sum of scores returned by applicable scoring functions
     """
     score = 0
     report_lines = []
-    for scoring_set_name in scoring_sets:
-        scoring_set = scoring_sets_registry[scoring_set_name]
-        for scoring_fn, weights, params in scoring_set:
-            unweighted_score = scoring_fn(fragment, **params)
-            curr_score = weight_score(unweighted_score, weights)
-            if report:
-                fn_name = scoring_fn.__name__.removeprefix('evaluate_')
-                report_line = f'{fn_name:>40}: {curr_score}'
-                report_lines.append(report_line)
-            score += curr_score
+    scoring_fns_with_args = (
+        scoring_fn_with_args
+        for scoring_set_name in scoring_sets
+        for scoring_fn_with_args in scoring_sets_registry[scoring_set_name]
+    )
+    for scoring_fn, weights, params in scoring_fns_with_args:
+        unweighted_score = scoring_fn(fragment, **params)
+        curr_score = weight_score(unweighted_score, weights)
+        if report:
+            fn_name = scoring_fn.__name__.removeprefix('evaluate_')
+            report_line = f'{fn_name:>40}: {curr_score}'
+            report_lines.append(report_line)
+        score += curr_score
+        if score < cutoff:
+            break
     if report:
         report_lines.append(f'Overall score is: {score}')
         report_str = '\n'.join(report_lines)
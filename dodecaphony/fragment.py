@@ -6,24 +6,43 @@ Author: Nikolay Lysenko
 
 
 import itertools
-import math
 import random
 from dataclasses import dataclass
+from operator import attrgetter
 from typing import Any, Optional
 
 from sinethesizer.utils.music_theory import get_note_to_position_mapping
 
 from .music_theory import (
     N_SEMITONES_PER_OCTAVE,
+    PITCH_CLASS_TO_POSITION,
+    get_forms_of_tone_row,
     get_smallest_intervals_between_pitch_classes,
-    get_tone_row_transformations_registry,
-    invert_tone_row,
-    revert_tone_row
+    get_tone_row_transformations_registry
 )
 
 
 NOTE_TO_POSITION_MAPPING = get_note_to_position_mapping()
+LOW_OCTAVE_POSITIONS = {
+    pitch_class: NOTE_TO_POSITION_MAPPING[pitch_class + '1']
+    for pitch_class in PITCH_CLASS_TO_POSITION
+}
+HIGH_OCTAVE_POSITIONS = {
+    pitch_class: NOTE_TO_POSITION_MAPPING[pitch_class + '7']
+    for pitch_class in PITCH_CLASS_TO_POSITION
+}
 SMALLEST_INTERVALS_MAPPING = get_smallest_intervals_between_pitch_classes()
+# Nested mapping is faster to query in loops, because no tuple keys are created and hashed.
+SMALLEST_INTERVALS_TABLE = {
+    starting_pitch_class: {
+        destination_pitch_class: SMALLEST_INTERVALS_MAPPING[
+            (starting_pitch_class, destination_pitch_class)
+        ]
+        for destination_pitch_class in PITCH_CLASS_TO_POSITION
+    }
+    for starting_pitch_class in PITCH_CLASS_TO_POSITION
+}
+TIMELINE_ORDER = attrgetter('start_time', 'line_index')
 
 
 @dataclass
@@ -103,6 +122,17 @@ class Fragment:
             and self.sonic_content == other.sonic_content
         )
 
+    def fingerprint(self) -> tuple:
+        """Return hashable representation of the fragment that is consistent with equality."""
+        temporal_content = tuple(
+            tuple(tuple(measure_durations) for measure_durations in line_durations)
+            for line_durations in self.temporal_content
+        )
+        sonic_content = tuple(
+            tuple(group_sonic_content) for group_sonic_content in self.sonic_content
+        )
+        return temporal_content, sonic_content
+
 
 def validate_line_indices(params: FragmentParams) -> None:
     """
@@ -114,7 +144,7 @@ def validate_line_indices(params: FragmentParams) -> None:
         None
     """
     line_indices = [index for group in params.groups for index in group['melodic_line_indices']]
-    if sorted(line_indices) != sorted(list(set(line_indices))):
+    if len(set(line_indices)) != len(line_indices):
         raise ValueError("Line index can not be included in multiple groups.")
     if min(line_indices) < 0:
         raise ValueError("All line indices must be positive.")
@@ -216,7 +246,7 @@ def validate(params: FragmentParams) -> None:
     :return:
         None
     """
-    if sorted(params.line_ids) != list(set(params.line_ids)):
+    if len(set(params.line_ids)) != len(params.line_ids):
         raise ValueError("IDs of melodic lines must be unique.")
     validate_line_indices(params)
     validate_pauses(params)
@@ -261,10 +291,11 @@ def distribute_events_among_measures(
     """
     while True:
         measures_cum_sum = sorted(random.sample(range(1, n_events), n_measures - 1))
-        measures_cum_sum = [0] + measures_cum_sum + [n_events]
-        result = []
-        for former, latter in zip(measures_cum_sum, measures_cum_sum[1:]):
-            result.append(latter - former)
+        measures_cum_sum.append(n_events)
+        result = [
+            latter - former
+            for former, latter in zip(itertools.chain([0], measures_cum_sum), measures_cum_sum)
+        ]
         if all(x in measure_durations_by_n_events for x in result):  # pragma: no branch
             return result
 
@@ -392,11 +423,8 @@ def maybe_transform_pitch_classes(tone_row: list[str]) -> list[str]:
     :return:
         list of pitch classes from a form of the tone row
     """
-    current_instance = [pitch_class for pitch_class in tone_row]
-    if random.choice([True, False]):
-        current_instance = invert_tone_row(current_instance)
-    if random.choice([True, False]):
-        current_instance = revert_tone_row(current_instance)
+    forms = get_forms_of_tone_row(tuple(tone_row))
+    current_instance = list(random.choice(forms))
     return current_instance
 
 
@@ -504,7 +532,8 @@ def find_initial_pauses_indices(params: FragmentParams) -> tuple[list[list[int]]
         immutable_pauses_indices = group_params.get('immutable_pauses_indices', [])
         n_mutable_pauses_indices = n_pauses - len(immutable_pauses_indices)
         if n_mutable_pauses_indices > 0:
-            free_indices = [i for i in range(n_events) if i not in immutable_pauses_indices]
+            occupied_indices = set(immutable_pauses_indices)
+            free_indices = [i for i in range(n_events) if i not in occupied_indices]
             mutable_pauses_indices = random.sample(free_indices, n_mutable_pauses_indices)
         else:
             mutable_pauses_indices = []
@@ -570,48 +599,50 @@ def set_sonic_content(fragment: Fragment) -> None:
         fragment.grouped_immutable_pauses_indices
     )
     for tone_row_instances, mutable_pauses_indices, immutable_pauses_indices in zipped:
+        pitch_classes = itertools.chain.from_iterable(
+            tone_row_instance.pitch_classes for tone_row_instance in tone_row_instances
+        )
         group_sonic_content = []
-        for tone_row_instance in tone_row_instances:
-            group_sonic_content.extend(tone_row_instance.pitch_classes)
         # Below, sorting is needed to place pauses exactly at the required places.
         pauses_indices = sorted(mutable_pauses_indices + immutable_pauses_indices)
         for pause_index in pauses_indices:
-            group_sonic_content = (
-                group_sonic_content[:pause_index]
-                + ['pause']
-                + group_sonic_content[pause_index:]
+            n_pitch_classes_before_pause = pause_index - len(group_sonic_content)
+            group_sonic_content.extend(
+                itertools.islice(pitch_classes, n_pitch_classes_before_pause)
             )
+            group_sonic_content.append('pause')
+        group_sonic_content.extend(pitch_classes)
         sonic_content.append(group_sonic_content)
     fragment.sonic_content = sonic_content
 
 
-def create_grouped_rhythm_only_lines(fragment: Fragment) -> list[list[list[Event]]]:
+def create_grouped_timelines(fragment: Fragment) -> list[list[tuple[float, int, float]]]:
     """
-    Create rhythm-only lines grouped by sharing of the same series.
+    Create timelines of melodic lines grouped by sharing of the same series.
 
     :param fragment:
         fragment with non-empty temporal content
     :return:
-        list where for each group of melodic lines sharing the same series for each melodic line
-        there are events representing temporal (loosely speaking, rhythmic) structure of the line,
-        but keeping no information about pitches
+        list where for each group of melodic lines sharing the same series there are
+        time-ordered tuples of start time, line index, and duration representing
+        temporal (loosely speaking, rhythmic) structure of the group
     """
-    rhythm_only_lines = []
+    grouped_timelines = []
     for _, line_indices in fragment.group_index_to_line_indices.items():
-        group_of_lines = []
+        timeline = []
         for line_index in line_indices:
-            line = []
-            start_time = 0
+            durations = []
             first_note_is_suspended = False
             line_durations = fragment.temporal_content[line_index]
             for measure_durations in line_durations:
-                for duration in measure_durations[int(first_note_is_suspended):]:
-                    line.append(Event(line_index, start_time, duration))
-                    start_time += duration
+                durations.extend(measure_durations[int(first_note_is_suspended):])
                 first_note_is_suspended = sum(measure_durations) > fragment.meter_numerator
-            group_of_lines.append(line)
-        rhythm_only_lines.append(group_of_lines)
-    return rhythm_only_lines
+            start_times = itertools.accumulate(durations, initial=0)
+            timeline.extend(zip(start_times, itertools.repeat(line_index), durations))
+        # Lines are already sorted by time, so sorting just merges these runs.
+        timeline.sort()
+        grouped_timelines.append(timeline)
+    return grouped_timelines
 
 
 def set_melodic_lines_and_their_pitch_classes(fragment: Fragment) -> None:
@@ -624,18 +655,11 @@ def set_melodic_lines_and_their_pitch_classes(fragment: Fragment) -> None:
         None
     """
     melodic_lines = [[] for _ in fragment.line_ids]
-    grouped_rhythm_only_lines = create_grouped_rhythm_only_lines(fragment)
-    zipped = zip(grouped_rhythm_only_lines, fragment.sonic_content)
-    for group_of_rhythm_only_lines, group_sonic_content in zipped:
-        timeline = [
-            event
-            for rhythm_only_line in group_of_rhythm_only_lines
-            for event in rhythm_only_line
-        ]
-        timeline = sorted(timeline, key=lambda event: (event.start_time, event.line_index))
-        for event, pitch_class in zip(timeline, group_sonic_content):
-            new_event = Event(event.line_index, event.start_time, event.duration, pitch_class)
-            melodic_lines[event.line_index].append(new_event)
+    grouped_timelines = create_grouped_timelines(fragment)
+    for timeline, group_sonic_content in zip(grouped_timelines, fragment.sonic_content):
+        for (start_time, line_index, duration), pitch_class in zip(timeline, group_sonic_content):
+            event = Event(line_index, start_time, duration, pitch_class)
+            melodic_lines[line_index].append(event)
     fragment.melodic_lines = melodic_lines
 
 
@@ -651,7 +675,7 @@ def set_sonorities(fragment: Fragment) -> None:
     sonorities = []
     melodic_lines = fragment.melodic_lines
     timeline = [event for melodic_line in melodic_lines for event in melodic_line]
-    timeline = sorted(timeline, key=lambda event: (event.start_time, event.line_index))
+    timeline.sort(key=TIMELINE_ORDER)
     indices = [-1 for _ in melodic_lines]
     current_times = [0 for _ in melodic_lines]
     previous_passed_time = 0
@@ -662,9 +686,8 @@ def set_sonorities(fragment: Fragment) -> None:
         if passed_time > previous_passed_time:
             events = [melodic_line[index] for melodic_line, index in zip(melodic_lines, indices)]
             non_pause_events = [event for event in events if event.pitch_class != "pause"]
-            sonority_start = max(event.start_time for event in events)
-            sonority_end = min(event.start_time + event.duration for event in events)
-            sonority = Sonority(events, non_pause_events, sonority_start, sonority_end)
+            # Sonority starts when the previous one ends and ends when any of its events ends.
+            sonority = Sonority(events, non_pause_events, previous_passed_time, passed_time)
             sonorities.append(sonority)
         previous_passed_time = passed_time
     fragment.sonorities = sonorities
@@ -681,8 +704,10 @@ def transpose_up(position: int, min_position: int) -> int:
     :return:
         transposed pitch
     """
-    shortage = max(min_position - position, 0)
-    position += int(math.ceil(shortage / N_SEMITONES_PER_OCTAVE)) * N_SEMITONES_PER_OCTAVE
+    shortage = min_position - position
+    if shortage > 0:
+        n_octaves = (shortage + N_SEMITONES_PER_OCTAVE - 1) // N_SEMITONES_PER_OCTAVE
+        position += n_octaves * N_SEMITONES_PER_OCTAVE
     return position
 
 
@@ -697,8 +722,10 @@ def transpose_down(position: int, max_position: int) -> int:
     :return:
         transposed pitch
     """
-    surplus = max(position - max_position, 0)
-    position -= int(math.ceil(surplus / N_SEMITONES_PER_OCTAVE)) * N_SEMITONES_PER_OCTAVE
+    surplus = position - max_position
+    if surplus > 0:
+        n_octaves = (surplus + N_SEMITONES_PER_OCTAVE - 1) // N_SEMITONES_PER_OCTAVE
+        position -= n_octaves * N_SEMITONES_PER_OCTAVE
     return position
 
 
@@ -715,15 +742,14 @@ def set_pitches_of_upper_line(fragment: Fragment) -> None:
     for index, event in enumerate(upper_line):  # pragma: no branch
         if event.pitch_class != 'pause':
             break
-    low_octave = '1'
-    position = NOTE_TO_POSITION_MAPPING[event.pitch_class + low_octave]
+    position = LOW_OCTAVE_POSITIONS[event.pitch_class]
     position = transpose_up(position, fragment.upper_line_lowest_position)
     event.position_in_semitones = position
     previous_event_pitch_class = event.pitch_class
     for event in upper_line[index + 1:]:
         if event.pitch_class == 'pause':
             continue
-        interval = SMALLEST_INTERVALS_MAPPING[(previous_event_pitch_class, event.pitch_class)]
+        interval = SMALLEST_INTERVALS_TABLE[previous_event_pitch_class][event.pitch_class]
         position += interval
         position = transpose_up(position, fragment.upper_line_lowest_position)
         position = transpose_down(position, fragment.upper_line_highest_position)
@@ -750,33 +776,39 @@ def set_pitches_of_lower_lines(
     """
     upper_first_event = fragment.melodic_lines[0][0]
     threshold = upper_first_event.position_in_semitones or fragment.upper_line_lowest_position
-    previous_positions = [threshold] + [None for _ in range(len(fragment.melodic_lines) - 1)]
-    previous_pitch_classes = [None for _ in range(len(fragment.melodic_lines))]
+    n_lines = len(fragment.melodic_lines)
+    previous_positions = [threshold] * n_lines
+    previous_pitch_classes = [None] * n_lines
     for sonority in fragment.sonorities:
         threshold = sonority.events[0].position_in_semitones or previous_positions[0]
         previous_positions[0] = threshold
         threshold -= 1  # It is inclusive, so subtraction prevents lines from overlapping.
-        for event in sonority.events[1:]:
-            if event.pitch_class == 'pause':
+        sonority_start = sonority.start_time
+        for event in itertools.islice(sonority.events, 1, None):
+            pitch_class = event.pitch_class
+            if pitch_class == 'pause':
                 threshold -= default_shift
                 continue
-            if event.start_time < sonority.start_time:
+            if event.start_time < sonority_start:
                 threshold = event.position_in_semitones - 1
                 continue
-            previous_pitch_class = previous_pitch_classes[event.line_index]
+            line_index = event.line_index
+            previous_pitch_class = previous_pitch_classes[line_index]
             if previous_pitch_class is None:
-                high_octave = '7'
-                position = NOTE_TO_POSITION_MAPPING[event.pitch_class + high_octave]
+                position = HIGH_OCTAVE_POSITIONS[pitch_class]
             else:
-                interval = SMALLEST_INTERVALS_MAPPING[(previous_pitch_class, event.pitch_class)]
-                position = previous_positions[event.line_index] + interval
-            position = transpose_down(position, threshold)
-            position = transpose_up(position, 0)
+                interval = SMALLEST_INTERVALS_TABLE[previous_pitch_class][pitch_class]
+                position = previous_positions[line_index] + interval
+            # Inlined `transpose_down(position, threshold)` and `transpose_up(position, 0)`.
+            if position > threshold:
+                position = threshold - (threshold - position) % N_SEMITONES_PER_OCTAVE
+            if position < 0:
+                position %= N_SEMITONES_PER_OCTAVE
             if threshold - position > max_interval:
                 position += N_SEMITONES_PER_OCTAVE
             event.position_in_semitones = position
-            previous_positions[event.line_index] = position
-            previous_pitch_classes[event.line_index] = event.pitch_class
+            previous_positions[line_index] = position
+            previous_pitch_classes[line_index] = pitch_class
             threshold = position - 1
 
 
@@ -839,3 +871,58 @@ def initialize_fragment(params: FragmentParams) -> Fragment:
     )
     override_calculated_attributes(fragment)
     return fragment
+
+
+def copy_fragment(fragment: Fragment, with_sonic_content: bool = True) -> Fragment:
+    """
+    Copy core data structures of a fragment and share its constants.
+
+    Calculated attributes other than sonic content are not copied, because they are overridden
+    after transformations anyway.
+
+    :param fragment:
+        fragment to be copied
+    :param with_sonic_content:
+        if it is set to `True`, sonic content is copied too (it is required for pauses shifts)
+    :return:
+        copy of the fragment that can be transformed without affecting the original fragment
+    """
+    # Durations of a measure are never modified in place (transformations replace them
+    # with lists from `measure_durations_by_n_events`), so they can be shared.
+    temporal_content = [line_durations.copy() for line_durations in fragment.temporal_content]
+    grouped_tone_row_instances = [
+        [
+            ToneRowInstance(
+                tone_row_instance.pitch_classes.copy(),
+                tone_row_instance.independent_instance_indices,
+                tone_row_instance.dependence_name,
+                tone_row_instance.dependence_params
+            )
+            for tone_row_instance in tone_row_instances
+        ]
+        for tone_row_instances in fragment.grouped_tone_row_instances
+    ]
+    sonic_content = (
+        [group_sonic_content.copy() for group_sonic_content in fragment.sonic_content]
+        if with_sonic_content else None
+    )
+    fragment_copy = Fragment(
+        temporal_content,
+        grouped_tone_row_instances,
+        [x.copy() for x in fragment.grouped_mutable_pauses_indices],
+        [x.copy() for x in fragment.grouped_immutable_pauses_indices],
+        fragment.n_beats,
+        fragment.meter_numerator,
+        fragment.meter_denominator,
+        fragment.measure_durations_by_n_events,
+        fragment.line_ids,
+        fragment.upper_line_highest_position,
+        fragment.upper_line_lowest_position,
+        fragment.tone_row_len,
+        fragment.group_index_to_line_indices,
+        fragment.mutable_temporal_content_indices,
+        fragment.mutable_independent_tone_row_instances_indices,
+        fragment.mutable_dependent_tone_row_instances_indices,
+        sonic_content
+    )
+    return fragment_copy
@@ -6,18 +6,35 @@ Author: Nikolay Lysenko
 
 
 import itertools
+from collections import Counter
 from collections.abc import Callable
 from enum import Enum
-from functools import cache
+from functools import cache, lru_cache
 from typing import Optional
 
 
 N_SEMITONES_PER_OCTAVE = 12
+TONE_ROW_CACHE_SIZE = 4096
+DIATONIC_SCALES_CACHE_SIZE = 65536
 PITCH_CLASS_TO_POSITION = {
     'C': 0, 'C#': 1, 'D': 2, 'D#': 3, 'E': 4, 'F': 5,
     'F#': 6, 'G': 7, 'G#': 8, 'A': 9, 'A#': 10, 'B': 11
 }
 POSITION_TO_PITCH_CLASS = {v: k for k, v in PITCH_CLASS_TO_POSITION.items()}
+TRANSPOSITION_TABLE = tuple(
+    {
+        pitch_class: POSITION_TO_PITCH_CLASS[(position + shift) % N_SEMITONES_PER_OCTAVE]
+        for pitch_class, position in PITCH_CLASS_TO_POSITION.items()
+    }
+    for shift in range(N_SEMITONES_PER_OCTAVE)
+)
+REFLECTION_TABLE = tuple(
+    {
+        pitch_class: POSITION_TO_PITCH_CLASS[(axis - position) % N_SEMITONES_PER_OCTAVE]
+        for pitch_class, position in PITCH_CLASS_TO_POSITION.items()
+    }
+    for axis in range(N_SEMITONES_PER_OCTAVE)
+)
 
 
 class IntervalTypes(Enum):
@@ -28,34 +45,35 @@ class IntervalTypes(Enum):
     NOT_AN_INTERVAL = 4
 
 
-N_SEMITONES_TO_INTERVAL_TYPE_WITH_CONSONANT_P4 = {
-    0: IntervalTypes.PERFECT_CONSONANCE,
-    1: IntervalTypes.DISSONANCE,
-    2: IntervalTypes.DISSONANCE,
-    3: IntervalTypes.IMPERFECT_CONSONANCE,
-    4: IntervalTypes.IMPERFECT_CONSONANCE,
-    5: IntervalTypes.IMPERFECT_CONSONANCE,
-    6: IntervalTypes.DISSONANCE,
-    7: IntervalTypes.PERFECT_CONSONANCE,
-    8: IntervalTypes.IMPERFECT_CONSONANCE,
-    9: IntervalTypes.IMPERFECT_CONSONANCE,
-    10: IntervalTypes.DISSONANCE,
-    11: IntervalTypes.DISSONANCE,
-}
-N_SEMITONES_TO_INTERVAL_TYPE_WITH_DISSONANT_P4 = {
-    0: IntervalTypes.PERFECT_CONSONANCE,
-    1: IntervalTypes.DISSONANCE,
-    2: IntervalTypes.DISSONANCE,
-    3: IntervalTypes.IMPERFECT_CONSONANCE,
-    4: IntervalTypes.IMPERFECT_CONSONANCE,
-    5: IntervalTypes.DISSONANCE,
-    6: IntervalTypes.DISSONANCE,
-    7: IntervalTypes.PERFECT_CONSONANCE,
-    8: IntervalTypes.IMPERFECT_CONSONANCE,
-    9: IntervalTypes.IMPERFECT_CONSONANCE,
-    10: IntervalTypes.DISSONANCE,
-    11: IntervalTypes.DISSONANCE,
-}
+# Below tuples are indexed by interval size (in semitones) reduced to an octave.
+N_SEMITONES_TO_INTERVAL_TYPE_WITH_CONSONANT_P4 = (
+    IntervalTypes.PERFECT_CONSONANCE,  # 0
+    IntervalTypes.DISSONANCE,  # 1
+    IntervalTypes.DISSONANCE,  # 2
+    IntervalTypes.IMPERFECT_CONSONANCE,  # 3
+    IntervalTypes.IMPERFECT_CONSONANCE,  # 4
+    IntervalTypes.IMPERFECT_CONSONANCE,  # 5
+    IntervalTypes.DISSONANCE,  # 6
+    IntervalTypes.PERFECT_CONSONANCE,  # 7
+    IntervalTypes.IMPERFECT_CONSONANCE,  # 8
+    IntervalTypes.IMPERFECT_CONSONANCE,  # 9
+    IntervalTypes.DISSONANCE,  # 10
+    IntervalTypes.DISSONANCE,  # 11
+)
+N_SEMITONES_TO_INTERVAL_TYPE_WITH_DISSONANT_P4 = (
+    IntervalTypes.PERFECT_CONSONANCE,  # 0
+    IntervalTypes.DISSONANCE,  # 1
+    IntervalTypes.DISSONANCE,  # 2
+    IntervalTypes.IMPERFECT_CONSONANCE,  # 3
+    IntervalTypes.IMPERFECT_CONSONANCE,  # 4
+    IntervalTypes.DISSONANCE,  # 5
+    IntervalTypes.DISSONANCE,  # 6
+    IntervalTypes.PERFECT_CONSONANCE,  # 7
+    IntervalTypes.IMPERFECT_CONSONANCE,  # 8
+    IntervalTypes.IMPERFECT_CONSONANCE,  # 9
+    IntervalTypes.DISSONANCE,  # 10
+    IntervalTypes.DISSONANCE,  # 11
+)
 
 
 @cache
@@ -69,18 +87,32 @@ def get_smallest_intervals_between_pitch_classes() -> dict[tuple[str, str], int]
         mapping from a pair of pitch classes to the smallest interval (in semitones)
         connecting them
     """
-    pitch_classes = PITCH_CLASS_TO_POSITION.keys()
-    cartesian_product = itertools.product(pitch_classes, pitch_classes)
-    result = {}
-    for starting_pitch_class, destination_pitch_class in cartesian_product:
-        destination_position = PITCH_CLASS_TO_POSITION[destination_pitch_class]
-        starting_position = PITCH_CLASS_TO_POSITION[starting_pitch_class]
-        shift = N_SEMITONES_PER_OCTAVE // 2 - 1
-        value = (destination_position - starting_position + shift) % N_SEMITONES_PER_OCTAVE - shift
-        result[(starting_pitch_class, destination_pitch_class)] = value
+    shift = N_SEMITONES_PER_OCTAVE // 2 - 1
+    positions = PITCH_CLASS_TO_POSITION.items()
+    result = {
+        (starting_pitch_class, destination_pitch_class): (
+            (destination_position - starting_position + shift) % N_SEMITONES_PER_OCTAVE - shift
+        )
+        for starting_pitch_class, starting_position in positions
+        for destination_pitch_class, destination_position in positions
+    }
     return result
 
 
+def get_interval_types_table(is_perfect_fourth_consonant: bool = True) -> tuple[IntervalTypes, ...]:
+    """
+    Get table of interval types indexed by interval size reduced to an octave.
+
+    :param is_perfect_fourth_consonant:
+        indicator whether perfect fourth is a consonant interval
+    :return:
+        types of intervals from unison to major seventh
+    """
+    if is_perfect_fourth_consonant:
+        return N_SEMITONES_TO_INTERVAL_TYPE_WITH_CONSONANT_P4
+    return N_SEMITONES_TO_INTERVAL_TYPE_WITH_DISSONANT_P4
+
+
 def get_type_of_interval(
         n_semitones: int, is_perfect_fourth_consonant: bool = True
 ) -> IntervalTypes:
@@ -94,13 +126,25 @@ def get_type_of_interval(
     :return:
         type of interval
     """
-    if is_perfect_fourth_consonant:
-        n_semitones_to_consonance = N_SEMITONES_TO_INTERVAL_TYPE_WITH_CONSONANT_P4
-    else:
-        n_semitones_to_consonance = N_SEMITONES_TO_INTERVAL_TYPE_WITH_DISSONANT_P4
-    n_semitones = abs(n_semitones)
-    n_semitones %= len(n_semitones_to_consonance)
-    return n_semitones_to_consonance[n_semitones]
+    interval_types_table = get_interval_types_table(is_perfect_fourth_consonant)
+    return interval_types_table[abs(n_semitones) % N_SEMITONES_PER_OCTAVE]
+
+
+@lru_cache(maxsize=TONE_ROW_CACHE_SIZE)
+def get_inversion(tone_row: tuple[str, ...]) -> tuple[str, ...]:
+    """
+    Get inversion of tone row preserving its first pitch class.
+
+    :param tone_row:
+        tone row as tuple of pitch classes (like C or C#, flats are not allowed)
+    :return:
+        inverted tone row
+    """
+    # Intervals telescope, so each inverted position is a reflection around the first one.
+    axis = 2 * PITCH_CLASS_TO_POSITION[tone_row[0]] % N_SEMITONES_PER_OCTAVE
+    reflection = REFLECTION_TABLE[axis]
+    inverted_tone_row = tuple([reflection[pitch_class] for pitch_class in tone_row])
+    return inverted_tone_row
 
 
 def invert_tone_row(tone_row: list[str]) -> list[str]:
@@ -112,16 +156,7 @@ def invert_tone_row(tone_row: list[str]) -> list[str]:
     :return:
         inverted tone row
     """
-    inverted_tone_row = [tone_row[0]]
-    for former_pitch_class, latter_pitch_class in zip(tone_row, tone_row[1:]):
-        latter_position = PITCH_CLASS_TO_POSITION[latter_pitch_class]
-        former_position = PITCH_CLASS_TO_POSITION[former_pitch_class]
-        interval = latter_position - former_position
-        next_position = (PITCH_CLASS_TO_POSITION[inverted_tone_row[-1]] - interval)
-        next_position %= N_SEMITONES_PER_OCTAVE
-        next_pitch_class = POSITION_TO_PITCH_CLASS[next_position]
-        inverted_tone_row.append(next_pitch_class)
-    return inverted_tone_row
+    return list(get_inversion(tuple(tone_row)))
 
 
 def revert_tone_row(tone_row: list[str]) -> list[str]:
@@ -150,6 +185,23 @@ def rotate_tone_row(tone_row: list[str], shift: int) -> list[str]:
     return tone_row[-shift:] + tone_row[:-shift]
 
 
+@lru_cache(maxsize=TONE_ROW_CACHE_SIZE)
+def get_transposition(tone_row: tuple[str, ...], shift_in_semitones: int) -> tuple[str, ...]:
+    """
+    Get transposition of tone row.
+
+    :param tone_row:
+        tone row as tuple of pitch classes (like C or C#, flats are not allowed)
+    :param shift_in_semitones:
+        transposition interval in semitones
+    :return:
+        transposed tone row
+    """
+    transposition = TRANSPOSITION_TABLE[shift_in_semitones % N_SEMITONES_PER_OCTAVE]
+    transposed_tone_row = tuple([transposition[pitch_class] for pitch_class in tone_row])
+    return transposed_tone_row
+
+
 def transpose_tone_row(tone_row: list[str], shift_in_semitones: int = 0) -> list[str]:
     """
     Transpose tone row.
@@ -161,13 +213,7 @@ def transpose_tone_row(tone_row: list[str], shift_in_semitones: int = 0) -> list
     :return:
         transposed tone row
     """
-    transposed_tone_row = []
-    for pitch_class in tone_row:
-        new_position = (PITCH_CLASS_TO_POSITION[pitch_class] + shift_in_semitones)
-        new_position %= N_SEMITONES_PER_OCTAVE
-        new_pitch_class = POSITION_TO_PITCH_CLASS[new_position]
-        transposed_tone_row.append(new_pitch_class)
-    return transposed_tone_row
+    return list(get_transposition(tuple(tone_row), shift_in_semitones))
 
 
 @cache
@@ -187,6 +233,21 @@ def get_tone_row_transformations_registry() -> dict[str, Callable]:
     return registry
 
 
+@cache
+def get_forms_of_tone_row(tone_row: tuple[str, ...]) -> tuple[tuple[str, ...], ...]:
+    """
+    Get prime, inverted, reverted, and reverted inverted forms of a tone row.
+
+    :param tone_row:
+        tone row as tuple of pitch classes (like C or C#, flats are not allowed)
+    :return:
+        four forms of the tone row
+    """
+    inverted_tone_row = get_inversion(tone_row)
+    forms = (tone_row, inverted_tone_row, tone_row[::-1], inverted_tone_row[::-1])
+    return forms
+
+
 @cache
 def get_mapping_from_pitch_class_to_diatonic_scales(
         scale_types: Optional[tuple[str]] = None
@@ -214,15 +275,44 @@ def get_mapping_from_pitch_class_to_diatonic_scales(
     }
     if scale_types is not None:
         patterns = {k: v for k, v in patterns.items() if k in scale_types}
+    # Each pattern is packed into 12-bit mask where i-th bit is set if i-th semitone is in scale.
+    masks = {
+        scale_type: sum(1 << index for index, degree in enumerate(pattern) if degree)
+        for scale_type, pattern in patterns.items()
+    }
+    full_mask = (1 << N_SEMITONES_PER_OCTAVE) - 1
     pitch_classes = list(PITCH_CLASS_TO_POSITION.keys())
     result = {pitch_class: [] for pitch_class in pitch_classes}
-    cartesian_product = itertools.product(patterns.items(), enumerate(pitch_classes))
-    for (scale_type, pattern), (offset, pitch_class) in cartesian_product:
+    cartesian_product = itertools.product(masks.items(), enumerate(pitch_classes))
+    for (scale_type, mask), (offset, pitch_class) in cartesian_product:
         if scale_type == 'whole_tone' and pitch_class not in ['C', 'C#']:
             continue  # Prevent creation of duplicated scales.
         scale_name = f'{pitch_class}-{scale_type}'
-        rotated_pitch_classes = pitch_classes[offset:] + pitch_classes[:offset]
-        for another_pitch_class, degree in zip(rotated_pitch_classes, pattern):
-            if degree:
+        rotated_mask = ((mask << offset) | (mask >> (N_SEMITONES_PER_OCTAVE - offset))) & full_mask
+        for position, another_pitch_class in enumerate(pitch_classes):
+            if rotated_mask >> position & 1:
                 result[another_pitch_class].append(scale_name)
     return result
+
+
+@lru_cache(maxsize=DIATONIC_SCALES_CACHE_SIZE)
+def count_pitch_classes_from_best_diatonic_scale(
+        pitch_classes: tuple[str, ...], scale_types: Optional[tuple[str]] = None
+) -> int:
+    """
+    Count pitch classes belonging to the diatonic scale that fits them best.
+
+    :param pitch_classes:
+        pitch classes (possibly, with repetitions); it is better to pass them sorted,
+        because order does not affect result, but it affects caching
+    :param scale_types:
+        types of diatonic scales to be tested
+        (see `get_mapping_from_pitch_class_to_diatonic_scales` for details)
+    :return:
+        number of pitch classes (with repetitions) from the most fitting diatonic scale
+    """
+    pitch_class_to_diatonic_scales = get_mapping_from_pitch_class_to_diatonic_scales(scale_types)
+    counter = Counter()
+    for pitch_class in pitch_classes:
+        counter.update(pitch_class_to_diatonic_scales[pitch_class])
+    return counter.most_common(1)[0][1]
@@ -5,16 +5,22 @@ Author: Nikolay Lysenko
 """
 
 
-import copy
+import heapq
 import math
 import os
+from collections import defaultdict
 from dataclasses import dataclass
+from operator import attrgetter
 from typing import Any, Optional
 
 from .evaluation import SCORING_SETS_REGISTRY_TYPE, evaluate
-from .fragment import Fragment
+from .fragment import Fragment, copy_fragment
 from .transformations import TRANSFORMATION_REGISTRY_TYPE, transform
-from .utils import starmap_in_parallel
+from .utils import create_pool
+
+
+SCORES_CACHE_SIZE = 10000
+WORKER_STATE: dict[str, Any] = {}
 
 
 @dataclass
@@ -42,13 +48,22 @@ def select_distinct_best_records(records: list[Record], n_records: int) -> list[
     :return:
         best records
     """
-    results = []
-    for record in sorted(records, key=lambda x: -x.score):
-        if record not in results:
-            results.append(record)
-        if len(results) == n_records:
-            break
-    return results
+    # Usually, there are few duplicates, so a partial sort of top records is enough.
+    n_candidates = max(n_records, 1)
+    while True:
+        results = []
+        score_to_fragments = defaultdict(list)
+        for record in heapq.nlargest(n_candidates, records, key=attrgetter('score')):
+            # Equal records have equal scores, so only fragments with the same score are compared.
+            fragments = score_to_fragments[record.score]
+            if record.fragment not in fragments:
+                fragments.append(record.fragment)
+                results.append(record)
+            if len(results) == n_records:
+                return results
+        if n_candidates >= len(records):
+            return results
+        n_candidates *= 2
 
 
 def generate_new_records(
@@ -59,7 +74,8 @@ def generate_new_records(
         transformation_names: list[str],
         transformation_probabilities: list[float],
         scoring_sets: list[str],
-        scoring_sets_registry: SCORING_SETS_REGISTRY_TYPE
+        scoring_sets_registry: SCORING_SETS_REGISTRY_TYPE,
+        fingerprint_to_score: Optional[dict[tuple, float]] = None
 ) -> list[Record]:  # pragma: no cover  # Actually, it is covered, but `pytest-cov` misses it.
     """
     Generate records for given tasks.
@@ -85,35 +101,23 @@ def generate_new_records(
     :param scoring_sets_registry:
         mapping from a name of a scoring set to a list of triples of a scoring function,
         its weight, and its parameters
+    :param fingerprint_to_score:
+        cache of scores of already evaluated fragments; it is updated in place and
+        it must be used only with the same scoring sets
     :return:
         best generated records
     """
     new_records = []
+    with_sonic_content = 'pause_shift' in transformation_names
+    # Short chains of transformations often lead to the same candidates, so scores are reused.
+    fingerprint_to_score = {} if fingerprint_to_score is None else fingerprint_to_score
+    # Candidates that are worse than all of the current best distinct ones are not evaluated fully.
+    best_scores = []
+    seen_fingerprints = set()
     for task in tasks:
         incumbent_solution = task.incumbent_solution
-        for trial_id in range(task.n_trials):
-            candidate = Fragment(
-                copy.deepcopy(incumbent_solution.temporal_content),
-                copy.deepcopy(incumbent_solution.grouped_tone_row_instances),
-                [copy.copy(x) for x in incumbent_solution.grouped_mutable_pauses_indices],
-                [copy.copy(x) for x in incumbent_solution.grouped_immutable_pauses_indices],
-                incumbent_solution.n_beats,
-                incumbent_solution.meter_numerator,
-                incumbent_solution.meter_denominator,
-                incumbent_solution.measure_durations_by_n_events,
-                incumbent_solution.line_ids,
-                incumbent_solution.upper_line_highest_position,
-                incumbent_solution.upper_line_lowest_position,
-                incumbent_solution.tone_row_len,
-                incumbent_solution.group_index_to_line_indices,
-                incumbent_solution.mutable_temporal_content_indices,
-                incumbent_solution.mutable_independent_tone_row_instances_indices,
-                incumbent_solution.mutable_dependent_tone_row_instances_indices,
-                (
-                    [copy.copy(x) for x in incumbent_solution.sonic_content]
-                    if 'pause_shift' in transformation_names else None
-                )
-            )
+        for _ in range(task.n_trials):
+            candidate = copy_fragment(incumbent_solution, with_sonic_content)
             candidate = transform(
                 candidate,
                 n_transformations_per_trial,
@@ -121,13 +125,94 @@ def generate_new_records(
                 transformation_names,
                 transformation_probabilities
             )
-            score, _ = evaluate(candidate, scoring_sets, scoring_sets_registry)
-            score = round(score, 10)  # Prevent overflow during records comparison.
+            cutoff = best_scores[0] if len(best_scores) == n_records_to_return else -math.inf
+            fingerprint = candidate.fingerprint()
+            score = fingerprint_to_score.get(fingerprint)
+            if score is None:
+                score, _ = evaluate(candidate, scoring_sets, scoring_sets_registry, cutoff=cutoff)
+                if score < cutoff:
+                    continue  # Partial score must not be cached.
+                score = round(score, 10)  # Prevent overflow during records comparison.
+                if len(fingerprint_to_score) >= SCORES_CACHE_SIZE:
+                    del fingerprint_to_score[next(iter(fingerprint_to_score))]
+                fingerprint_to_score[fingerprint] = score
+            elif score < cutoff:
+                continue
+            if fingerprint not in seen_fingerprints:
+                seen_fingerprints.add(fingerprint)
+                if len(best_scores) < n_records_to_return:
+                    heapq.heappush(best_scores, score)
+                else:
+                    heapq.heappushpop(best_scores, score)
             new_records.append(Record(candidate, score))
     new_records = select_distinct_best_records(new_records, n_records_to_return)
     return new_records
 
 
+def set_worker_state(
+        transformation_registry: TRANSFORMATION_REGISTRY_TYPE,
+        scoring_sets: list[str],
+        scoring_sets_registry: SCORING_SETS_REGISTRY_TYPE
+) -> None:  # pragma: no cover  # Actually, it is covered, but `pytest-cov` misses it.
+    """
+    Store arguments that do not change between iterations in a process of pool.
+
+    Also, create cache of scores that is shared by all iterations handled by the process.
+
+    :param transformation_registry:
+        mapping from names to corresponding transformations and their arguments
+    :param scoring_sets:
+        names of scoring sets to be used for fragments evaluation
+    :param scoring_sets_registry:
+        mapping from a name of a scoring set to a list of triples of a scoring function,
+        its weight, and its parameters
+    :return:
+        None
+    """
+    WORKER_STATE['transformation_registry'] = transformation_registry
+    WORKER_STATE['scoring_sets'] = scoring_sets
+    WORKER_STATE['scoring_sets_registry'] = scoring_sets_registry
+    WORKER_STATE['fingerprint_to_score'] = {}
+
+
+def generate_new_records_with_worker_state(
+        tasks: list[Task],
+        n_records_to_return: int,
+        n_transformations_per_trial: int,
+        transformation_names: list[str],
+        transformation_probabilities: list[float]
+) -> list[Record]:  # pragma: no cover  # Actually, it is covered, but `pytest-cov` misses it.
+    """
+    Generate records for given tasks with arguments stored by `set_worker_state`.
+
+    :param tasks:
+        fragments such that their neighborhoods should be searched
+        and numbers of transformed fragments to generate and evaluate for each of them
+    :param n_records_to_return:
+        number of best records to return
+    :param n_transformations_per_trial:
+        number of transformations to be applied to generate a new fragment
+    :param transformation_names:
+        names of transformations to choose from
+    :param transformation_probabilities:
+        probabilities of corresponding transformations;
+        this argument must have the same length as `transformation_names`
+    :return:
+        best generated records
+    """
+    return generate_new_records(
+        tasks,
+        n_records_to_return,
+        n_transformations_per_trial,
+        WORKER_STATE['transformation_registry'],
+        transformation_names,
+        transformation_probabilities,
+        WORKER_STATE['scoring_sets'],
+        WORKER_STATE['scoring_sets_registry'],
+        WORKER_STATE['fingerprint_to_score']
+    )
+
+
 def create_tasks(
         incumbent_solutions: list[Fragment],
         n_trials_per_iteration: int,
@@ -155,7 +240,8 @@ def create_tasks(
     tasks = [[Task(incumbent_solutions[0], 0)]]
     i = 0
     while i < len(raw_tasks):
-        if raw_tasks[i].incumbent_solution not in [task.incumbent_solution for task in tasks[-1]]:
+        # Raw tasks are processed in order, so only the last task of a process may share incumbent.
+        if not tasks[-1] or tasks[-1][-1].incumbent_solution is not raw_tasks[i].incumbent_solution:
             tasks[-1].append(Task(raw_tasks[i].incumbent_solution, 0))
         n_trials_to_add = min(remaining_n_trials_per_current_process, raw_tasks[i].n_trials)
         tasks[-1][-1].n_trials += n_trials_to_add
@@ -222,11 +308,18 @@ def optimize_with_variable_neighborhood_search(
     current_cycle_best_score = -1e9
     current_cycle_initial_score = -1e9
 
+    neighborhoods_params = [
+        (
+            neighborhood['n_transformations_per_trial'],
+            list(neighborhood['transformation_probabilities'].keys()),
+            list(neighborhood['transformation_probabilities'].values())
+        )
+        for neighborhood in neighborhoods
+    ]
     neighborhood_index = 0
-    neighborhood = neighborhoods[neighborhood_index]
-    n_transformations_per_trial = neighborhood['n_transformations_per_trial']
-    transformation_names = list(neighborhood['transformation_probabilities'].keys())
-    transformation_probabilities = list(neighborhood['transformation_probabilities'].values())
+    n_transformations_per_trial, transformation_names, transformation_probabilities = (
+        neighborhoods_params[neighborhood_index]
+    )
 
     n_transformations_per_perturbation = perturbation['n_transformations']
     perturbation_names = list(perturbation['transformation_probabilities'].keys())
@@ -234,61 +327,73 @@ def optimize_with_variable_neighborhood_search(
 
     paralleling_params = paralleling_params or {}
 
-    for iteration_id in range(n_iterations):
-        all_tasks = create_tasks(incumbent_solutions, n_trials_per_iteration, paralleling_params)
-        args = [
-            (
-                tasks_for_process,
-                beam_width,
-                n_transformations_per_trial,
-                transformation_registry,
-                transformation_names,
-                transformation_probabilities,
-                scoring_sets,
-                scoring_sets_registry
+    # Arguments that are the same at all iterations are sent to each process just once.
+    pool = create_pool(
+        paralleling_params,
+        set_worker_state,
+        (transformation_registry, scoring_sets, scoring_sets_registry)
+    )
+    try:
+        for iteration_id in range(n_iterations):
+            # Calculated attributes are not needed by child processes, so they are not pickled.
+            light_incumbent_solutions = [copy_fragment(x) for x in incumbent_solutions]
+            all_tasks = create_tasks(
+                light_incumbent_solutions, n_trials_per_iteration, paralleling_params
             )
-            for tasks_for_process in all_tasks
-        ]
-        nested_new_records = starmap_in_parallel(generate_new_records, args, paralleling_params)
-        new_records = [record for records in nested_new_records for record in records]
-        best_new_records = select_distinct_best_records(new_records, beam_width)
-        current_best_score = best_new_records[0].score
-        current_cycle_best_score = max(current_cycle_best_score, current_best_score)
-
-        if current_best_score > previous_best_score:
-            incumbent_solutions = [record.fragment for record in best_new_records]
-            previous_best_score = current_best_score
-        else:
-            neighborhood_index += 1
-            if neighborhood_index == len(neighborhoods):
-                if current_cycle_best_score <= current_cycle_initial_score:
-                    perturbed_records = generate_new_records(
-                        [Task(fragment, 1) for fragment in incumbent_solutions],
-                        beam_width,
-                        n_transformations_per_perturbation,
-                        transformation_registry,
-                        perturbation_names,
-                        perturbation_probabilities,
-                        scoring_sets,
-                        scoring_sets_registry
-                    )
-                    incumbent_solutions = [record.fragment for record in perturbed_records]
-                    current_best_score = max(record.score for record in perturbed_records)
-                    previous_best_score = current_cycle_best_score = current_best_score
-                    best_new_records = select_distinct_best_records(perturbed_records, beam_width)
-                neighborhood_index = 0
-                current_cycle_initial_score = current_cycle_best_score
-            neighborhood = neighborhoods[neighborhood_index]
-            n_transformations_per_trial = neighborhood['n_transformations_per_trial']
-            transformation_names = list(neighborhood['transformation_probabilities'].keys())
-            transformation_probabilities = list(neighborhood['transformation_probabilities'].values())
-
-        records = select_distinct_best_records(records + best_new_records, beam_width)
-        global_best_score = records[0].score
-        print(
-            f'Iteration #{iteration_id:>3}: '
-            f'global_best_score = {global_best_score:.5f}, '
-            f'current_best_score = {current_best_score:.5f}'
-        )
+            args = [
+                (
+                    tasks_for_process,
+                    beam_width,
+                    n_transformations_per_trial,
+                    transformation_names,
+                    transformation_probabilities
+                )
+                for tasks_for_process in all_tasks
+            ]
+            nested_new_records = pool.starmap(generate_new_records_with_worker_state, args)
+            new_records = [record for records in nested_new_records for record in records]
+            best_new_records = select_distinct_best_records(new_records, beam_width)
+            current_best_score = best_new_records[0].score
+            current_cycle_best_score = max(current_cycle_best_score, current_best_score)
+
+            if current_best_score > previous_best_score:
+                incumbent_solutions = [record.fragment for record in best_new_records]
+                previous_best_score = current_best_score
+            else:
+                neighborhood_index += 1
+                if neighborhood_index == len(neighborhoods):
+                    if current_cycle_best_score <= current_cycle_initial_score:
+                        perturbed_records = generate_new_records(
+                            [Task(fragment, 1) for fragment in incumbent_solutions],
+                            beam_width,
+                            n_transformations_per_perturbation,
+                            transformation_registry,
+                            perturbation_names,
+                            perturbation_probabilities,
+                            scoring_sets,
+                            scoring_sets_registry
+                        )
+                        incumbent_solutions = [record.fragment for record in perturbed_records]
+                        current_best_score = max(record.score for record in perturbed_records)
+                        previous_best_score = current_cycle_best_score = current_best_score
+                        best_new_records = select_distinct_best_records(
+                            perturbed_records, beam_width
+                        )
+                    neighborhood_index = 0
+                    current_cycle_initial_score = current_cycle_best_score
+                n_transformations_per_trial, transformation_names, transformation_probabilities = (
+                    neighborhoods_params[neighborhood_index]
+                )
+
+            records = select_distinct_best_records(records + best_new_records, beam_width)
+            global_best_score = records[0].score
+            print(
+                f'Iteration #{iteration_id:>3}: '
+                f'global_best_score = {global_best_score:.5f}, '
+                f'current_best_score = {current_best_score:.5f}'
+            )
+    finally:
+        pool.close()
+        pool.join()
     result = [record.fragment for record in records]
     return result
@@ -10,7 +10,10 @@ import os
 import subprocess
 import traceback
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
 from math import ceil, floor
+from operator import itemgetter
 from pkg_resources import resource_filename
 from typing import Any
 
@@ -27,10 +30,26 @@ from sinethesizer.utils.music_theory import get_list_of_notes, get_note_to_posit
 
 from .constants import LILYPOND_RECIPROCAL_DURATIONS_BY_METER_SIGNATURE
 from .fragment import Event, Fragment
+from .music_theory import PITCH_CLASS_TO_POSITION
 
 
 NOTE_TO_POSITION = get_note_to_position_mapping()
 POSITION_TO_NOTE = {v: k for k, v in NOTE_TO_POSITION.items()}
+SILENT_PITCH_CLASSES = frozenset({'pause', 'skip'})
+MIDI_NUMBER_OF_LOWEST_NOTE = pretty_midi.note_name_to_number('A0')
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+LILYPOND_DEFAULT_OCTAVE_ID = 3
+PITCH_CLASS_TO_LILYPOND_NOTE_NAME = {
+    pitch_class: pitch_class.replace('#', 'is').replace('b', 'es').lower()
+    for pitch_class in PITCH_CLASS_TO_POSITION
+}
+POSITION_TO_LILYPOND_OCTAVE_INFO = {
+    position: (
+        ("'" if int(note[-1]) >= LILYPOND_DEFAULT_OCTAVE_ID else ',')
+        * abs(int(note[-1]) - LILYPOND_DEFAULT_OCTAVE_ID)
+    )
+    for position, note in POSITION_TO_NOTE.items()
+}
 
 
 def create_midi_from_fragment(
@@ -62,12 +81,13 @@ def create_midi_from_fragment(
     :return:
         None
     """
-    numeration_shift = pretty_midi.note_name_to_number('A0')
+    numeration_shift = MIDI_NUMBER_OF_LOWEST_NOTE
     pretty_midi_instruments = []
+    # Events of a melodic line go one after another, so notes are added in sorted order.
     for line_id, melodic_line in zip(fragment.line_ids, fragment.melodic_lines):
         pretty_midi_instrument = pretty_midi.Instrument(instruments[line_id], name=str(line_id))
         for event in melodic_line:
-            if event.pitch_class in ['pause', 'skip']:
+            if event.pitch_class in SILENT_PITCH_CLASSES:
                 continue
             start_time = event.start_time * beat_in_seconds
             start_time += opening_silence_in_seconds
@@ -80,7 +100,6 @@ def create_midi_from_fragment(
                 velocity=velocity
             )
             pretty_midi_instrument.notes.append(note)
-        pretty_midi_instrument.notes.sort(key=lambda x: (x.start, x.pitch))
         pretty_midi_instruments.append(pretty_midi_instrument)
 
     trailing_silence_start = fragment.n_beats * beat_in_seconds
@@ -135,26 +154,20 @@ def create_tsv_events_from_fragment(
     for line_id, melodic_line in zip(fragment.line_ids, fragment.melodic_lines):
         instrument = instruments[line_id]
         line_effects = effects.get(line_id, '')
+        # Velocity, effects, and line ID are the same for all events from a line.
+        line_suffix = f"\t{velocity}\t{line_effects}\t{line_id}"
         for event in melodic_line:
-            if event.pitch_class in ['pause', 'skip']:
+            if event.pitch_class in SILENT_PITCH_CLASSES:
                 continue
             start_time = event.start_time * beat_in_seconds
             start_time += opening_silence_in_seconds
             duration_in_seconds = event.duration * beat_in_seconds
             pitch_id = event.position_in_semitones
             note = all_notes[pitch_id]
-            event = (
-                instrument,
-                start_time,
-                duration_in_seconds,
-                note,
-                pitch_id,
-                line_effects,
-                line_id
-            )
-            events.append(event)
-    events = sorted(events, key=lambda x: (x[1], x[4], x[2]))
-    events = [f"{x[0]}\t{x[1]}\t{x[2]}\t{x[3]}\t{velocity}\t{x[5]}\t{x[6]}" for x in events]
+            line = f"{instrument}\t{start_time}\t{duration_in_seconds}\t{note}{line_suffix}"
+            events.append(((start_time, pitch_id, duration_in_seconds), line))
+    events.sort(key=itemgetter(0))
+    events = [line for _, line in events]
 
     columns = [
         'instrument',
@@ -168,8 +181,7 @@ def create_tsv_events_from_fragment(
     header = '\t'.join(columns)
     results = [header] + events
     with open(events_path, 'w') as out_file:
-        for line in results:
-            out_file.write(line + '\n')
+        out_file.write('\n'.join(results) + '\n')
 
 
 def create_sinethesizer_instruments() -> dict[str, Instrument]:
@@ -251,7 +263,7 @@ def create_yaml_from_fragment(fragment: Fragment, yaml_path: str) -> None:
     }
     result = {'groups': groups, 'temporal_content': temporal_content}
     with open(yaml_path, 'w') as out_file:
-        yaml.dump(result, out_file, default_flow_style=None)
+        yaml.dump(result, out_file, Dumper=YAML_DUMPER, default_flow_style=None)
 
 
 def make_lilypond_template(
@@ -339,20 +351,20 @@ def get_lilypond_order_of_voices(n_voices: int) -> list[int]:
     ]
     upper_voices_priorities = enumerate_for_one_staff(n_voices_at_upper_staff)
     priorities = lower_voices_priorities + upper_voices_priorities
-    ordering = sorted(
-        list((index, priority) for index, priority in enumerate(priorities)),
-        key=lambda x: x[1], reverse=True
-    )
-    ordering = [x[0] for x in ordering]
+    # Priorities are a permutation of voice indices, so the ordering is its inverse.
+    ordering = [0] * n_voices
+    for index, priority in enumerate(priorities):
+        ordering[n_voices - 1 - priority] = index
     return ordering
 
 
+@cache
 def find_lilypond_duration(
         duration: float,
         time_in_measure: float,
         meter_numerator: int,
         meter_denominator: int
-) -> list[str]:
+) -> tuple[str, ...]:
     """
     Find duration of a note in Lilypond reciprocal format.
 
@@ -368,31 +380,25 @@ def find_lilypond_duration(
         strings representing Lilypond durations of notes (a note can be split to multiple notes
         if it crosses bar or if its duration is compound and requires ties)
     """
-    if time_in_measure + duration <= meter_numerator:
-        meter_signature = f"{meter_numerator}/{meter_denominator}"
-        lilypond_mapping = LILYPOND_RECIPROCAL_DURATIONS_BY_METER_SIGNATURE[meter_signature]
-        reciprocal_duration = meter_numerator / duration
+    meter_signature = f"{meter_numerator}/{meter_denominator}"
+    lilypond_mapping = LILYPOND_RECIPROCAL_DURATIONS_BY_METER_SIGNATURE[meter_signature]
+    durations_within_measures = []
+    while time_in_measure + duration > meter_numerator:
+        durations_within_measures.append(meter_numerator - time_in_measure)
+        duration = duration - meter_numerator + time_in_measure
+        time_in_measure = 0
+    durations_within_measures.append(duration)
+
+    results = []
+    for duration_within_measure in durations_within_measures:
+        reciprocal_duration = meter_numerator / duration_within_measure
         lilypond_duration = lilypond_mapping.get(reciprocal_duration)
         if lilypond_duration is None:
             raise RuntimeError(f"Reciprocal duration {reciprocal_duration} is not supported yet.")
-        return lilypond_duration
-    else:
-        remaining_duration = meter_numerator - time_in_measure
-        remaining_results = find_lilypond_duration(
-            remaining_duration,
-            time_in_measure,
-            meter_numerator,
-            meter_denominator
-        )
-        remaining_results = remaining_results[:-1] + [remaining_results[-1] + '~']
-        left_over_bar_duration = duration - meter_numerator + time_in_measure
-        left_over_bar_results = find_lilypond_duration(
-            left_over_bar_duration,
-            0,
-            meter_numerator,
-            meter_denominator
-        )
-        return remaining_results + left_over_bar_results
+        if results:
+            results[-1] += '~'
+        results.extend(lilypond_duration)
+    return tuple(results)
 
 
 def convert_to_lilypond_note(event: Event, meter_numerator: int, meter_denominator: int) -> str:
@@ -408,29 +414,21 @@ def convert_to_lilypond_note(event: Event, meter_numerator: int, meter_denominat
     :return:
         note in Lilypond absolute notation
     """
-    if event.pitch_class == 'pause':
+    pitch_class = event.pitch_class
+    if pitch_class == 'pause':
         note_without_duration = 'r'
     else:
-        pitch_class = event.pitch_class
-        pitch_class = pitch_class.replace('#', 'is').replace('b', 'es')
-        pitch_class = pitch_class.lower()
-
-        octave_id = int(POSITION_TO_NOTE[event.position_in_semitones][-1])
-        lilypond_default_octave_id = 3
-        octave_diff = octave_id - lilypond_default_octave_id
-        octave_sign = "'" if octave_diff >= 0 else ','
-        octave_info = "".join(octave_sign for _ in range(abs(octave_diff)))
-
-        note_without_duration = pitch_class + octave_info
+        lilypond_note_name = PITCH_CLASS_TO_LILYPOND_NOTE_NAME[pitch_class]
+        octave_info = POSITION_TO_LILYPOND_OCTAVE_INFO[event.position_in_semitones]
+        note_without_duration = lilypond_note_name + octave_info
 
-    start_time = event.start_time
-    time_in_measure = start_time % meter_numerator
+    time_in_measure = event.start_time % meter_numerator
     durations = find_lilypond_duration(
         event.duration, time_in_measure, meter_numerator, meter_denominator
     )
     note = [f"{note_without_duration}{duration}" for duration in durations]
     note = " ".join(note)
-    if event.pitch_class in ['pause', 'skip']:
+    if pitch_class in SILENT_PITCH_CLASSES:
         note = note.replace('~', '')  # Lilypond warns when pauses or skips are tied.
     return note
 
@@ -447,26 +445,25 @@ def create_lilypond_file_from_fragment(fragment: Fragment, output_path: str) ->
         None
     """
     n_voices = len(fragment.melodic_lines)
+    meter_numerator = fragment.meter_numerator
+    meter_denominator = fragment.meter_denominator
     template = make_lilypond_template(
         n_voices,
         # For a dodecaphonic piece, there is no tonic and no scale type
         # and the two below constants affect nothing.
         'C',
         'major',
-        fragment.meter_numerator,
-        fragment.meter_denominator
+        meter_numerator,
+        meter_denominator
     )
     lilypond_voices = []
     indices = get_lilypond_order_of_voices(n_voices)
     for index in indices:
         melodic_line = fragment.melodic_lines[index]
-        lilypond_voice = []
-        for event in melodic_line:
-            note = convert_to_lilypond_note(
-                event, fragment.meter_numerator, fragment.meter_denominator
-            )
-            lilypond_voice.append(note)
-        lilypond_voice = " ".join(lilypond_voice)
+        lilypond_voice = " ".join(
+            convert_to_lilypond_note(event, meter_numerator, meter_denominator)
+            for event in melodic_line
+        )
         lilypond_voices.append(lilypond_voice)
     result = template.format(*lilypond_voices)
     with open(output_path, 'w') as out_file:
@@ -500,6 +497,23 @@ def create_pdf_sheet_music_with_lilypond(lilypond_path: str) -> None:  # pragma:
         print("https://lilypond.org/doc/v2.24/Documentation/learning/installing")
 
 
+def create_sheet_music_from_fragment(
+        fragment: Fragment, lilypond_path: str
+) -> None:  # pragma: no cover
+    """
+    Create Lilypond file and PDF file with sheet music.
+
+    :param fragment:
+        musical fragment
+    :param lilypond_path:
+        path where resulting Lilypond file is going to be saved
+    :return:
+        None
+    """
+    create_lilypond_file_from_fragment(fragment, lilypond_path)
+    create_pdf_sheet_music_with_lilypond(lilypond_path)
+
+
 def render(fragment: Fragment, rendering_params: dict[str, Any]) -> None:  # pragma: no cover
     """
     Save fragment to MIDI, WAV, TSV, PDF, and Lilypond files.
@@ -526,10 +540,6 @@ def render(fragment: Fragment, rendering_params: dict[str, Any]) -> None:  # pra
     trailing_silence_in_sec = common_params.pop('trailing_silence_in_seconds')
     create_tsv_events_from_fragment(fragment, events_path, **events_params, **common_params)
 
-    wav_path = os.path.join(nested_dir, 'music.wav')
-    instruments_registry = create_sinethesizer_instruments()
-    create_wav_from_tsv_events(events_path, wav_path, instruments_registry, trailing_silence_in_sec)
-
     yaml_path = os.path.join(nested_dir, 'content.yml')
     create_yaml_from_fragment(fragment, yaml_path)
 
@@ -537,13 +547,25 @@ def render(fragment: Fragment, rendering_params: dict[str, Any]) -> None:  # pra
     with open(meta_information_path, 'w') as in_file:
         in_file.write(rendering_params['meta_information'] + '\n')
 
+    wav_path = os.path.join(nested_dir, 'music.wav')
     meter_signature = f"{fragment.meter_numerator}/{fragment.meter_denominator}"
-    if meter_signature not in LILYPOND_RECIPROCAL_DURATIONS_BY_METER_SIGNATURE:
-        warnings.warn(
-            f"Meter signature {meter_signature} is not supported in sheet music rendering. "
-            "Only MIDI and WAV outputs are saved."
+    # Sheet music is rendered while WAV file is synthesized, but any error from it is raised
+    # only after WAV file is saved.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        sheet_music_future = None
+        if meter_signature in LILYPOND_RECIPROCAL_DURATIONS_BY_METER_SIGNATURE:
+            lilypond_path = os.path.join(nested_dir, 'sheet_music.ly')
+            sheet_music_future = executor.submit(
+                create_sheet_music_from_fragment, fragment, lilypond_path
+            )
+        else:
+            warnings.warn(
+                f"Meter signature {meter_signature} is not supported in sheet music rendering. "
+                "Only MIDI and WAV outputs are saved."
+            )
+        instruments_registry = create_sinethesizer_instruments()
+        create_wav_from_tsv_events(
+            events_path, wav_path, instruments_registry, trailing_silence_in_sec
         )
-        return
-    lilypond_path = os.path.join(nested_dir, 'sheet_music.ly')
-    create_lilypond_file_from_fragment(fragment, lilypond_path)
-    create_pdf_sheet_music_with_lilypond(lilypond_path)
+        if sheet_music_future is not None:
+            sheet_music_future.result()
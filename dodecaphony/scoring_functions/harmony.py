@@ -7,18 +7,22 @@ Author: Nikolay Lysenko
 
 import itertools
 import math
-from collections import Counter, defaultdict
+from collections import defaultdict
+from functools import lru_cache
 from typing import Any, Optional
 
 from dodecaphony.fragment import Event, Fragment
 from dodecaphony.music_theory import (
     IntervalTypes,
     N_SEMITONES_PER_OCTAVE,
-    get_mapping_from_pitch_class_to_diatonic_scales,
-    get_type_of_interval,
+    count_pitch_classes_from_best_diatonic_scale,
+    get_interval_types_table,
 )
 
 
+SONORITY_TYPES_CACHE_SIZE = 65536
+
+
 def evaluate_absence_of_doubled_pitch_classes(fragment: Fragment) -> float:
     """
     Evaluate absence of vertical intervals that are multiples of an octave (except unisons).
@@ -161,7 +165,8 @@ def find_indices_of_dissonating_events(
     for first_event, second_event in itertools.combinations(sonority_events, 2):
         n_semitones = first_event.position_in_semitones - second_event.position_in_semitones
         is_perfect_fourth_consonant = second_event.line_index != n_melodic_lines - 1
-        interval_type = get_type_of_interval(n_semitones, is_perfect_fourth_consonant)
+        interval_types_table = get_interval_types_table(is_perfect_fourth_consonant)
+        interval_type = interval_types_table[abs(n_semitones) % N_SEMITONES_PER_OCTAVE]
         if interval_type != IntervalTypes.DISSONANCE:
             continue
         first_event_continues = first_event.start_time < sonority_start_time
@@ -242,7 +247,8 @@ def evaluate_dissonances_preparation_and_resolution(
     for sonority in fragment.sonorities:
         zipped = zip(sonority.events, fragment.melodic_lines, event_indices)
         for event, melodic_line, event_index in zipped:
-            if event != melodic_line[event_index]:
+            # Sonorities share events with melodic lines, so identity check is enough here.
+            if event is not melodic_line[event_index]:
                 event_indices[event.line_index] += 1
         pt_and_ngh_line_indices, suspension_line_indices = find_indices_of_dissonating_events(
             sonority.non_pause_events, sonority.start_time,
@@ -294,6 +300,70 @@ def compute_harmonic_stability_of_sonority(
     return stability
 
 
+def freeze_positions(
+        regular_positions: list[dict[str, Any]], ad_hoc_positions: list[dict[str, Any]],
+        n_beats: int
+) -> tuple[tuple[tuple[str, int, float], ...], tuple[tuple[str, float], ...]]:
+    """
+    Convert parameters of positions to hashable tuples.
+
+    :param regular_positions:
+        parameters of regular positions (for example, downbeats or relatively strong beats)
+    :param ad_hoc_positions:
+        parameters of ad hoc positions which appear just once
+        (for example, the beginning of the fragment or the 11th reference beat)
+    :param n_beats:
+        total duration of a fragment (in reference beats)
+    :return:
+        names, denominators, and remainders of regular positions and
+        names and non-negative times of ad hoc positions
+    """
+    frozen_regular_positions = tuple(
+        (position['name'], position['denominator'], position['remainder'])
+        for position in regular_positions
+    )
+    frozen_ad_hoc_positions = tuple(
+        (position['name'], position['time'] + n_beats if position['time'] < 0 else position['time'])
+        for position in ad_hoc_positions
+    )
+    return frozen_regular_positions, frozen_ad_hoc_positions
+
+
+@lru_cache(maxsize=SONORITY_TYPES_CACHE_SIZE)
+def find_sonority_type_by_frozen_positions(
+        sonority_start: float, sonority_end: float,
+        regular_positions: tuple[tuple[str, int, float], ...],
+        ad_hoc_positions: tuple[tuple[str, float], ...]
+) -> str:
+    """
+    Find type of sonority with positions converted by `freeze_positions`.
+
+    :param sonority_start:
+        start time of sonority (in reference beats)
+    :param sonority_end:
+        end time of sonority (in reference beats)
+    :param regular_positions:
+        names, denominators, and remainders of regular positions
+    :param ad_hoc_positions:
+        names and non-negative times of ad hoc positions
+    :return:
+        type of sonority based on its position in time
+    """
+    for name, time in ad_hoc_positions:
+        if sonority_start <= time < sonority_end:
+            return name
+    for name, denominator, remainder in regular_positions:
+        ratio = math.floor(sonority_start) // denominator
+        processed_start = sonority_start - ratio * denominator
+        processed_end = sonority_end - ratio * denominator
+        current_time = remainder
+        while current_time < processed_end:
+            if current_time >= processed_start:
+                return name
+            current_time += denominator
+    return 'default'
+
+
 def find_sonority_type(
         sonority_start: float, sonority_end: float, regular_positions: list[dict[str, Any]],
         ad_hoc_positions: list[dict[str, Any]], n_beats: int
@@ -301,6 +371,9 @@ def find_sonority_type(
     """
     Find type of sonority based on its position in time.
 
+    Scoring functions call `find_sonority_type_by_frozen_positions` directly, but this function
+    is kept as public API that accepts positions in the same format as a config.
+
     Note that collisions are resolved according to the two following rules:
     1) Ad hoc positions have higher precedence than regular positions;
     2) Precedence amongst either ad hoc positions or regular positions is based on order of
@@ -320,22 +393,8 @@ def find_sonority_type(
     :return:
         type of sonority based on its position in time
     """
-    for ad_hoc_position in ad_hoc_positions:
-        if ad_hoc_position['time'] < 0:
-            ad_hoc_position['time'] += n_beats
-        if sonority_start <= ad_hoc_position['time'] < sonority_end:
-            return ad_hoc_position['name']
-    for regular_position in regular_positions:
-        denominator = regular_position['denominator']
-        ratio = math.floor(sonority_start) // denominator
-        processed_start = sonority_start - ratio * denominator
-        processed_end = sonority_end - ratio * denominator
-        current_time = regular_position['remainder']
-        while current_time < processed_end:
-            if current_time >= processed_start:
-                return regular_position['name']
-            current_time += denominator
-    return 'default'
+    frozen_positions = freeze_positions(regular_positions, ad_hoc_positions, n_beats)
+    return find_sonority_type_by_frozen_positions(sonority_start, sonority_end, *frozen_positions)
 
 
 def evaluate_harmony_dynamic_by_positions(
@@ -361,13 +420,13 @@ def evaluate_harmony_dynamic_by_positions(
         average over all sonorities deviation of harmonic stability from its ranges
     """
     score = 0
+    frozen_positions = freeze_positions(regular_positions, ad_hoc_positions, fragment.n_beats)
     for sonority in fragment.sonorities:
         stability_of_current_sonority = compute_harmonic_stability_of_sonority(
             sonority.non_pause_events, n_semitones_to_stability
         )
-        sonority_type = find_sonority_type(
-            sonority.start_time, sonority.end_time, regular_positions, ad_hoc_positions,
-            fragment.n_beats
+        sonority_type = find_sonority_type_by_frozen_positions(
+            sonority.start_time, sonority.end_time, *frozen_positions
         )
         min_allowed_value = ranges[sonority_type][0]
         score += min(stability_of_current_sonority - min_allowed_value, 0)
@@ -451,19 +510,17 @@ def evaluate_local_diatonicity_at_all_lines_level(
     """
     score = 0
     scale_types = scale_types or ('major', 'harmonic_minor', 'whole_tone')
-    pitch_class_to_diatonic_scales = get_mapping_from_pitch_class_to_diatonic_scales(scale_types)
-    nested_pitch_classes = []
-    for sonority in fragment.sonorities[:depth - 1]:
-        nested_pitch_classes.append([event.pitch_class for event in sonority.non_pause_events])
-    for sonority in fragment.sonorities[depth - 1:]:
-        nested_pitch_classes.append([event.pitch_class for event in sonority.non_pause_events])
-        pitch_classes = [x for y in nested_pitch_classes for x in y]
-        counter = Counter()
-        for pitch_class in pitch_classes:
-            counter.update(pitch_class_to_diatonic_scales[pitch_class])
-        n_pitch_classes_from_best_scale = counter.most_common(1)[0][1]
+    nested_pitch_classes = [
+        [event.pitch_class for event in sonority.non_pause_events]
+        for sonority in fragment.sonorities
+    ]
+    for index in range(depth - 1, len(nested_pitch_classes)):
+        period = nested_pitch_classes[index - depth + 1:index + 1]
+        pitch_classes = sorted(x for y in period for x in y)
+        n_pitch_classes_from_best_scale = count_pitch_classes_from_best_diatonic_scale(
+            tuple(pitch_classes), scale_types
+        )
         score -= 1 - n_pitch_classes_from_best_scale / len(pitch_classes)
-        nested_pitch_classes.pop(0)
     n_periods = len(fragment.sonorities) - depth + 1
     score /= n_periods
     return score
@@ -483,14 +540,15 @@ def evaluate_motion_to_perfect_consonances(fragment: Fragment) -> float:
     for previous_sonority, sonority in zip(fragment.sonorities, fragment.sonorities[1:]):
         zipped = zip(previous_sonority.events, sonority.events)
         for line_index, (previous_event, current_event) in enumerate(zipped):
-            if previous_event != current_event:
+            if previous_event is not current_event:
                 previous_events[line_index] = previous_event
 
         pairs = itertools.combinations(sonority.non_pause_events, 2)
         for first_event, second_event in pairs:
             n_semitones = first_event.position_in_semitones - second_event.position_in_semitones
             is_perfect_fourth_consonant = second_event.line_index != len(sonority.events) - 1
-            interval_type = get_type_of_interval(n_semitones, is_perfect_fourth_consonant)
+            interval_types_table = get_interval_types_table(is_perfect_fourth_consonant)
+            interval_type = interval_types_table[abs(n_semitones) % N_SEMITONES_PER_OCTAVE]
             if interval_type != IntervalTypes.PERFECT_CONSONANCE:
                 continue
 
@@ -518,7 +576,7 @@ def evaluate_motion_to_perfect_consonances(fragment: Fragment) -> float:
                 first_previous_event.position_in_semitones
                 - second_previous_event.position_in_semitones
             )
-            interval_type = get_type_of_interval(n_semitones, is_perfect_fourth_consonant)
+            interval_type = interval_types_table[abs(n_semitones) % N_SEMITONES_PER_OCTAVE]
             if interval_type == IntervalTypes.PERFECT_CONSONANCE:
                 score -= 1
             if (
@@ -576,7 +634,8 @@ def evaluate_movement_to_final_sonority(
     zipped = zip(final_pitches, final_moves, bass_indicators)
     pairs = itertools.combinations(zipped, 2)
     for (first, first_move, _), (second, second_move, is_bass) in pairs:
-        interval_type = get_type_of_interval(first - second, not is_bass)
+        interval_types_table = get_interval_types_table(not is_bass)
+        interval_type = interval_types_table[abs(first - second) % N_SEMITONES_PER_OCTAVE]
         if interval_type not in consonant_types:
             continue
         if first_move * second_move < 0:
@@ -650,17 +709,21 @@ def evaluate_presence_of_vertical_intervals(
         minus one multiplied by fraction of lacking occurrences weight
     """
     weighted_n_occurrences = 0
+    frozen_positions = freeze_positions(regular_positions, ad_hoc_positions, fragment.n_beats)
+    n_intervals = len(intervals)
     for sonority in fragment.sonorities:
-        actual_intervals = []
         non_pause_events = sonority.non_pause_events
-        for upper_event, lower_event in zip(non_pause_events, non_pause_events[1:]):
-            interval = upper_event.position_in_semitones - lower_event.position_in_semitones
-            actual_intervals.append(interval)
-        if actual_intervals != intervals:
+        if max(len(non_pause_events) - 1, 0) != n_intervals:
+            continue
+        zipped = zip(non_pause_events, non_pause_events[1:], intervals)
+        deviations = (
+            upper_event.position_in_semitones - lower_event.position_in_semitones - interval
+            for upper_event, lower_event, interval in zipped
+        )
+        if any(deviations):
             continue
-        position_type = find_sonority_type(
-            sonority.start_time, sonority.end_time, regular_positions, ad_hoc_positions,
-            fragment.n_beats
+        position_type = find_sonority_type_by_frozen_positions(
+            sonority.start_time, sonority.end_time, *frozen_positions
         )
         weighted_n_occurrences += position_weights[position_type]
     score = min(weighted_n_occurrences - min_n_weighted_occurrences, 0)
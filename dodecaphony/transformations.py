@@ -109,9 +109,9 @@ def apply_measure_durations_change(fragment: Fragment) -> Fragment:
         modified fragment
     """
     line_index = random.choice(fragment.mutable_temporal_content_indices)
-    measure_index, measure_durations = random.choice(
-        list(enumerate(fragment.temporal_content[line_index]))
-    )
+    line_durations = fragment.temporal_content[line_index]
+    measure_index = random.randrange(len(line_durations))
+    measure_durations = line_durations[measure_index]
     candidate_durations = fragment.measure_durations_by_n_events[len(measure_durations)]
     if len(candidate_durations) > 1:
         candidate_durations = [x for x in candidate_durations if x != measure_durations]
@@ -130,9 +130,10 @@ def apply_crossmeasure_event_transfer(fragment: Fragment) -> Fragment:
         modified fragment
     """
     line_index = random.choice(fragment.mutable_temporal_content_indices)
-    (first_index, first_durations), (second_index, second_durations) = random.sample(
-        list(enumerate(fragment.temporal_content[line_index])), 2
-    )
+    line_durations = fragment.temporal_content[line_index]
+    first_index, second_index = random.sample(range(len(line_durations)), 2)
+    first_durations = line_durations[first_index]
+    second_durations = line_durations[second_index]
     if len(first_durations) > 1:
         first_key = len(first_durations) - 1
         second_key = len(second_durations) + 1
@@ -162,7 +163,7 @@ def apply_line_durations_change(fragment: Fragment) -> Fragment:
     line_index = random.choice(fragment.mutable_temporal_content_indices)
     line_durations = fragment.temporal_content[line_index]
     n_measures = len(line_durations)
-    n_events = len([x for measure_durations in line_durations for x in measure_durations])
+    n_events = sum(map(len, line_durations))
     new_line_durations = split_time_span(
         n_measures, n_events, fragment.measure_durations_by_n_events
     )
@@ -183,7 +184,7 @@ def apply_pause_shift(fragment: Fragment) -> Fragment:
     for group_index, mutable_pauses_indices in enumerate(fragment.grouped_mutable_pauses_indices):
         max_index = len(fragment.sonic_content[group_index]) - 1
         immutable_pauses_indices = fragment.grouped_immutable_pauses_indices[group_index]
-        pauses_indices = mutable_pauses_indices + immutable_pauses_indices
+        pauses_indices = set(mutable_pauses_indices + immutable_pauses_indices)
         for pause_index in mutable_pauses_indices:
             if pause_index > 0 and pause_index - 1 not in pauses_indices:
                 options.append((group_index, pause_index, False))
@@ -6,42 +6,40 @@ Author: Nikolay Lysenko
 
 
 import multiprocessing as mp
+import multiprocessing.pool
 from typing import Any, Callable, Optional
 
 
-def starmap_in_parallel(
-        fn: Callable, args: list[Any], pool_kwargs: Optional[dict[str, Any]] = None
-) -> list[Any]:
+def create_pool(
+        pool_kwargs: Optional[dict[str, Any]] = None,
+        initializer: Optional[Callable] = None,
+        initargs: tuple[Any, ...] = ()
+) -> mp.pool.Pool:
     """
-    Apply function to each collection of arguments from the given list in parallel.
+    Create pool of processes.
 
-    This function contains boilerplate code that is needed for correct work of `pytest-cov`.
-    Usage of `mp.Pool` as context manager is not alternative to this function, because:
+    Pool must be closed and joined explicitly, because it is needed for correct work of
+    `pytest-cov`. Usage of `mp.Pool` as context manager is not alternative to this, because:
     1) not all covered lines of code may be marked as covered
        (see more: https://pytest-cov.readthedocs.io/en/latest/subprocess-support.html);
     2) some files with names like '.coverage.hostname.*' may be not deleted
        (see more: https://github.com/pytest-dev/pytest-cov/issues/250).
 
-    :param fn:
-        function
-    :param args:
-        list of collections of arguments
     :param pool_kwargs:
         parameters of pool such as number of processes and maximum number of
         tasks for a worker before it is replaced with a new one
+    :param initializer:
+        function to be called in each process when it starts
+    :param initargs:
+        arguments of the initializer
     :return:
-        results of applying the function to the arguments
+        pool of processes
     """
     pool_kwargs = pool_kwargs or {}
     key_renaming = {'n_processes': 'processes', 'max_tasks_per_child': 'maxtasksperchild'}
     pool_kwargs = {key_renaming.get(k, k): v for k, v in pool_kwargs.items()}
-    pool = mp.Pool(**pool_kwargs)
-    try:
-        results = pool.starmap(fn, args)
-    finally:
-        pool.close()
-        pool.join()
-    return results
+    pool = mp.Pool(initializer=initializer, initargs=initargs, **pool_kwargs)
+    return pool
 
 
 def compute_rolling_aggregate(
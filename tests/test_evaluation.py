@@ -18,6 +18,26 @@ from dodecaphony.fragment import Event, Fragment, ToneRowInstance, override_calc
 from .conftest import MEASURE_DURATIONS_BY_N_EVENTS
 
 
+@pytest.mark.parametrize(
+    "unweighted_scores, cutoff, expected",
+    [
+        ([-0.5, -0.25], -1.0, -0.75),
+        ([-0.5, -0.25], -0.3, -0.5),
+        ([-0.5, -0.25], -0.5, -0.75),
+    ]
+)
+def test_evaluate(unweighted_scores: list[float], cutoff: float, expected: float) -> None:
+    """Test `evaluate` function."""
+    scoring_sets_registry = {
+        'default': [
+            (lambda fragment, value: value, {0.0: 1.0}, {'value': unweighted_score})
+            for unweighted_score in unweighted_scores
+        ]
+    }
+    result, _ = evaluate(None, ['default'], scoring_sets_registry, cutoff=cutoff)
+    assert result == expected
+
+
 @pytest.mark.parametrize(
     "fragment, params, scoring_sets, expected",
     [
@@ -92,6 +112,34 @@ def test_parse_scoring_sets_registry(
     assert round(result, 10) == round(expected, 10)
 
 
+@pytest.mark.parametrize(
+    "params, match",
+    [
+        (
+            [
+                {
+                    'name': 'default',
+                    'scoring_functions': [
+                        {
+                            'name': 'absence_of_voice_crossing',
+                            'weights': {0.0: 1.0, -0.5: -1.0},
+                            'n_semitones_to_penalty': {0: 0.5},
+                        },
+                    ],
+                }
+            ],
+            "Weights must be non-negative"
+        ),
+    ]
+)
+def test_parse_scoring_sets_registry_with_invalid_weights(
+        params: list[dict[str, Any]], match: str
+) -> None:
+    """Test `parse_scoring_sets_registry` function with invalid weights."""
+    with pytest.raises(ValueError, match=match):
+        parse_scoring_sets_registry(params)
+
+
 @pytest.mark.parametrize(
     "unweighted_score, weights, expected",
     [
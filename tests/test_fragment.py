@@ -15,6 +15,7 @@ from dodecaphony.fragment import (
     FragmentParams,
     Sonority,
     ToneRowInstance,
+    copy_fragment,
     create_initial_grouped_tone_row_instances,
     create_initial_temporal_content,
     find_initial_pauses_indices,
@@ -28,6 +29,8 @@ from dodecaphony.fragment import (
     set_sonic_content,
     set_sonorities,
     split_time_span,
+    transpose_down,
+    transpose_up,
     update_dependent_tone_row_instance,
     update_dependent_tone_row_instances,
     validate,
@@ -35,6 +38,39 @@ from dodecaphony.fragment import (
 from .conftest import MEASURE_DURATIONS, MEASURE_DURATIONS_BY_N_EVENTS
 
 
+@pytest.mark.parametrize("with_sonic_content", [True, False])
+def test_copy_fragment(with_sonic_content: bool) -> None:
+    """Test `copy_fragment` function."""
+    params = FragmentParams(
+        tone_row=['B', 'A#', 'G', 'C#', 'D#', 'C', 'D', 'A', 'F#', 'E', 'G#', 'F'],
+        groups=[
+            {'melodic_line_indices': [0], 'tone_row_instances': [{}], 'n_pauses': 1},
+            {'melodic_line_indices': [1, 2], 'tone_row_instances': [{}, {}], 'n_pauses': 2},
+        ],
+        n_measures=4,
+        meter_numerator=4,
+        meter_denominator=4,
+        measure_durations=MEASURE_DURATIONS,
+        line_ids=[1, 2, 3],
+        upper_line_highest_note='E6',
+        upper_line_lowest_note='E4',
+    )
+    fragment = initialize_fragment(params)
+    fragment_copy = copy_fragment(fragment, with_sonic_content)
+    assert fragment_copy.temporal_content == fragment.temporal_content
+    assert fragment_copy.grouped_tone_row_instances == fragment.grouped_tone_row_instances
+    assert (fragment_copy.sonic_content == fragment.sonic_content) == with_sonic_content
+    override_calculated_attributes(fragment_copy)
+    assert fragment_copy == fragment
+
+    fragment_copy.temporal_content[0][0] = [-1.0]
+    fragment_copy.grouped_tone_row_instances[0][0].pitch_classes.reverse()
+    fragment_copy.grouped_mutable_pauses_indices[0].append(0)
+    assert fragment_copy.temporal_content != fragment.temporal_content
+    assert fragment_copy.grouped_tone_row_instances != fragment.grouped_tone_row_instances
+    assert fragment_copy.grouped_mutable_pauses_indices != fragment.grouped_mutable_pauses_indices
+
+
 @pytest.mark.parametrize(
     "params, expected",
     [
@@ -1095,6 +1131,36 @@ def test_split_time_span_with_invalid_arguments(
         split_time_span(n_measures, n_events, measure_durations_by_n_events)
 
 
+@pytest.mark.parametrize(
+    "position, max_position, expected",
+    [
+        (50, 55, 50),
+        (55, 55, 55),
+        (56, 55, 44),
+        (67, 55, 55),
+        (68, 55, 44),
+    ]
+)
+def test_transpose_down(position: int, max_position: int, expected: int) -> None:
+    """Test `transpose_down` function."""
+    assert transpose_down(position, max_position) == expected
+
+
+@pytest.mark.parametrize(
+    "position, min_position, expected",
+    [
+        (50, 45, 50),
+        (45, 45, 45),
+        (44, 45, 56),
+        (33, 45, 45),
+        (32, 45, 56),
+    ]
+)
+def test_transpose_up(position: int, min_position: int, expected: int) -> None:
+    """Test `transpose_up` function."""
+    assert transpose_up(position, min_position) == expected
+
+
 @pytest.mark.parametrize(
     "tone_row_instance, pitch_classes, expected",
     [
@@ -1263,6 +1329,28 @@ def test_validate(params: FragmentParams, match: str) -> None:
         validate(params)
 
 
+@pytest.mark.parametrize(
+    "params",
+    [
+        # IDs are unique, but iteration order of their set differs from their sorted order.
+        FragmentParams(
+            tone_row=['B', 'A#', 'G', 'C#', 'D#', 'C', 'D', 'A', 'F#', 'E', 'G#', 'F'],
+            groups=[{'melodic_line_indices': [0, 1], 'tone_row_instances': [{}, {}], 'n_pauses': 0}],
+            n_measures=8,
+            meter_numerator=4,
+            meter_denominator=4,
+            measure_durations=MEASURE_DURATIONS,
+            line_ids=[8, 1],
+            upper_line_highest_note='E6',
+            upper_line_lowest_note='E4'
+        ),
+    ]
+)
+def test_validate_with_valid_params(params: FragmentParams) -> None:
+    """Test that `validate` function accepts valid parameters."""
+    validate(params)
+
+
 @pytest.mark.parametrize(
     "first_temporal_content, second_temporal_content, "
     "first_grouped_tone_row_instances, second_grouped_tone_row_instances, "
@@ -1275,6 +1363,13 @@ def test_validate(params: FragmentParams, match: str) -> None:
             [[ToneRowInstance(['B', 'A#', 'G', 'C#', 'D#', 'C', 'D', 'A', 'F#', 'E', 'G#', 'F'])]],
             True
         ),
+        (
+            [[[1.0 for _ in range(4)] for __ in range(3)]],
+            [[[1.0 for _ in range(4)] for __ in range(3)]],
+            [[ToneRowInstance(['B', 'A#', 'G', 'C#', 'D#', 'C', 'D', 'A', 'F#', 'E', 'G#', 'F'])]],
+            [[ToneRowInstance(['A#', 'B', 'G', 'C#', 'D#', 'C', 'D', 'A', 'F#', 'E', 'G#', 'F'])]],
+            False
+        ),
     ]
 )
 def test_equality_of_fragments(
@@ -1284,7 +1379,7 @@ def test_equality_of_fragments(
         second_grouped_tone_row_instances: list[list[ToneRowInstance]],
         expected: bool
 ) -> None:
-    """Test `__eq__` method of `Fragment` class."""
+    """Test `__eq__` and `fingerprint` methods of `Fragment` class."""
     first_fragment = Fragment(
         first_temporal_content,
         first_grouped_tone_row_instances,
@@ -1325,3 +1420,4 @@ def test_equality_of_fragments(
     override_calculated_attributes(second_fragment)
     result = first_fragment == second_fragment
     assert result == expected
+    assert (first_fragment.fingerprint() == second_fragment.fingerprint()) == expected
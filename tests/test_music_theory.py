@@ -11,6 +11,9 @@ import pytest
 
 from dodecaphony.music_theory import (
     IntervalTypes,
+    count_pitch_classes_from_best_diatonic_scale,
+    get_forms_of_tone_row,
+    get_interval_types_table,
     get_mapping_from_pitch_class_to_diatonic_scales,
     get_smallest_intervals_between_pitch_classes,
     get_type_of_interval,
@@ -21,6 +24,63 @@ from dodecaphony.music_theory import (
 )
 
 
+@pytest.mark.parametrize(
+    "pitch_classes, scale_types, expected",
+    [
+        (('C', 'D', 'E', 'F#'), ('major',), 4),
+        (('C', 'C', 'D', 'E', 'F', 'F#'), ('major',), 5),
+        (('C', 'C#', 'D', 'E', 'F#'), ('major', 'whole_tone'), 4),
+    ]
+)
+def test_count_pitch_classes_from_best_diatonic_scale(
+        pitch_classes: tuple[str, ...], scale_types: tuple[str], expected: int
+) -> None:
+    """Test `count_pitch_classes_from_best_diatonic_scale` function."""
+    result = count_pitch_classes_from_best_diatonic_scale(pitch_classes, scale_types)
+    assert result == expected
+
+
+@pytest.mark.parametrize(
+    "tone_row, expected",
+    [
+        (
+            # `tone_row`
+            ('B', 'A#', 'G', 'C#', 'D#', 'C', 'D', 'A', 'F#', 'E', 'G#', 'F'),
+            # `expected`
+            (
+                ('B', 'A#', 'G', 'C#', 'D#', 'C', 'D', 'A', 'F#', 'E', 'G#', 'F'),
+                ('B', 'C', 'D#', 'A', 'G', 'A#', 'G#', 'C#', 'E', 'F#', 'D', 'F'),
+                ('F', 'G#', 'E', 'F#', 'A', 'D', 'C', 'D#', 'C#', 'G', 'A#', 'B'),
+                ('F', 'D', 'F#', 'E', 'C#', 'G#', 'A#', 'G', 'A', 'D#', 'C', 'B'),
+            )
+        ),
+    ]
+)
+def test_get_forms_of_tone_row(
+        tone_row: tuple[str, ...], expected: tuple[tuple[str, ...], ...]
+) -> None:
+    """Test `get_forms_of_tone_row` function."""
+    forms = get_forms_of_tone_row(tone_row)
+    assert forms == expected
+
+
+@pytest.mark.parametrize(
+    "is_perfect_fourth_consonant, n_semitones, expected",
+    [
+        (True, 5, IntervalTypes.IMPERFECT_CONSONANCE),
+        (False, 5, IntervalTypes.DISSONANCE),
+        (False, 7, IntervalTypes.PERFECT_CONSONANCE),
+    ]
+)
+def test_get_interval_types_table(
+        is_perfect_fourth_consonant: bool, n_semitones: int, expected: IntervalTypes
+) -> None:
+    """Test `get_interval_types_table` function."""
+    interval_types_table = get_interval_types_table(is_perfect_fourth_consonant)
+    assert len(interval_types_table) == 12
+    assert interval_types_table[n_semitones] == expected
+
+
 @pytest.mark.parametrize(
     "scale_types, key, value",
     [
@@ -199,6 +199,13 @@ def test_optimize_with_variable_neighborhood_search(
     [
         ([], 5, []),
         ([Record('a', 0), Record('b', -1), Record('a', 0)], 2, [Record('a', 0), Record('b', -1)]),
+        (
+            [Record('a', 0), Record('a', 0), Record('a', 0), Record('c', -2), Record('b', -1)],
+            2,
+            [Record('a', 0), Record('b', -1)]
+        ),
+        ([Record('a', 0), Record('b', 0), Record('a', 0)], 5, [Record('a', 0), Record('b', 0)]),
+        ([Record('a', 0), Record('b', -1), Record('a', 0)], 0, [Record('a', 0), Record('b', -1)]),
     ]
 )
 def test_select_distinct_best_records(